@@ -24,8 +24,8 @@ class LLMActor:
             self,
             lang_obs: Union[str, List[str]],
             lang_actions: List[str],
-            env_actions: List[List[str]],
+            env_actions: List[int],
             return_tuple: bool = False
-        ) -> Union[List[str], Tuple[List[str], str, str, int]]:
+        ) -> Union[int, Tuple[int, str, str, int]]:
 
         raise NotImplementedError()
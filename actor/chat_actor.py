@@ -1,17 +1,31 @@
-from typing import List, Union, Tuple, Dict, Any
+from typing import List, Optional, Union, Tuple, Dict, Any
 import torch
 import json
 
 from actor import LLMActor
-from utils.gpt_utils import get_chat
+from utils.gpt_utils import get_chat, get_letter_token
 from utils.nle_utils import TASK_TO_DESC
+from utils.fewshot_utils import FewshotStore
 
 
 class ChatActor(LLMActor):
-    def __init__(self, fewshot=4, use_cot=True, **kwargs):
+    def __init__(
+            self,
+            fewshot=4,
+            use_cot=True,
+            letter_only=False,
+            fewshot_store: Optional[FewshotStore] = None,
+            stream=False,
+            **kwargs
+        ):
         super().__init__(**kwargs)
+        if use_cot and letter_only:
+            raise ValueError("Chain of thought and letter only answers can not be combined")
         self.fewshot = fewshot
         self.use_cot = use_cot
+        self.letter_only = letter_only
+        self.fewshot_store = fewshot_store
+        self.stream = stream
 
     def reset(self, task_description: str = ""):
         return super().reset(task_description)
@@ -24,27 +38,35 @@ class ChatActor(LLMActor):
         ) -> List[str]:
 
         turns = []
-        examples = NLE_EXMAPLES[:self.fewshot]
+        if self.fewshot_store is not None:
+            examples = self.fewshot_store.query(task, state, admissible, self.fewshot)
+        else:
+            examples = NLE_EXMAPLES[:self.fewshot]
         for example in examples:
 
-            turns.append("{}Game Description:\n{}\n\nChoose the best action.\n{}".format(
+            turns.append("{}Game Description:\n{}\n\nChoose the best action.\n{}{}".format(
                 "Your task is to {}\n\n".format(
                     TASK_TO_DESC[example["task_id"]]
                 ),
                 "\n".join(example["state"]),
                 "\n".join(["{}) {}".format(chr(ord('A') + i), a) for i, a in enumerate(example["admissible"])]),
+                LETTER_ONLY_INSTRUCTION if self.letter_only else "",
             ))
 
-            turns.append("{}I choose to: {}) {}".format(
-                "{}\n\n".format(example["act_explanation"]) if self.use_cot else "",
-                chr(ord('A') + example["admissible"].index(example["action"])), 
-                example["action"]
-            ))
+            if self.letter_only:
+                turns.append(chr(ord('A') + example["admissible"].index(example["action"])))
+            else:
+                turns.append("{}I choose to: {}) {}".format(
+                    "{}\n\n".format(example["act_explanation"]) if self.use_cot and example.get("act_explanation") else "",
+                    chr(ord('A') + example["admissible"].index(example["action"])), 
+                    example["action"]
+                ))
 
-        turns.append("Your task is to {}\n\nGame Description:\n{}\n\nChoose the best action.\n{}".format(
+        turns.append("Your task is to {}\n\nGame Description:\n{}\n\nChoose the best action.\n{}{}".format(
             task,
             "\n".join(state),
             "\n".join(["{}) {}".format(chr(ord('A') + i), a) for i, a in enumerate(admissible)]),
+            LETTER_ONLY_INSTRUCTION if self.letter_only else "",
         ))
 
         return turns
@@ -68,21 +90,16 @@ class ChatActor(LLMActor):
             actions
         )
 
-        out, tokens = get_chat(turns, system_message=self.prompt + " " + self.affordances)
-        
-        predicted = out
-        action_start_idx = predicted.find("I choose to:")
-        action_end_idx = len(predicted)
-        if action_start_idx > -1:
-            action_start_idx += len("I choose to:")+4
-            action_end_idx = [
-                predicted[action_start_idx:].find("\n"),
-                predicted[action_start_idx:].find(","),
-                predicted[action_start_idx:].find("."),
-                predicted[action_start_idx:].find(" and")
-            ]
-            action_end_idx = min([len(predicted)] + [action_start_idx + x for x in action_end_idx if x > -1])
-            predicted = predicted[action_start_idx:action_end_idx]
+        if self.letter_only:
+            return self._get_letter_score(turns, actions)
+
+        out, tokens = get_chat(
+            turns,
+            system_message=self.prompt + " " + self.affordances,
+            stream=self.stream,
+            stop_parser=lambda x: self._find_choice(x)[1]
+        )
+        predicted, _ = self._find_choice(out)
 
         scores = torch.tensor([
             sum(int(token in a.strip().lower().split())
@@ -93,13 +110,47 @@ class ChatActor(LLMActor):
 
         return scores, out, tokens
 
+    def _find_choice(self, out: str) -> Tuple[str, bool]:
+        # The choice is committed once the text after "I choose to:" has ended,
+        # later text can not change it wherever the explanation is
+        action_start_idx = out.find("I choose to:")
+        if action_start_idx == -1:
+            return out, False
+        action_start_idx += len("I choose to:")+4
+        action_end_idx = [
+            out[action_start_idx:].find("\n"),
+            out[action_start_idx:].find(","),
+            out[action_start_idx:].find("."),
+            out[action_start_idx:].find(" and")
+        ]
+        action_end_idx = [action_start_idx + x for x in action_end_idx if x > -1]
+        return out[action_start_idx:min([len(out)] + action_end_idx)], len(action_end_idx) > 0
+
+    def _get_letter_score(
+            self,
+            turns: List[str],
+            actions: List[str]
+        ) -> Tuple[torch.Tensor, str, int]:
+        letters = [chr(ord('A') + i) for i in range(len(actions))]
+        out, tokens = get_chat(
+            turns,
+            max_len=1,
+            system_message=self.prompt + " " + self.affordances,
+            logit_bias={get_letter_token(x): 100 for x in letters}
+        )
+
+        scores = torch.full((len(actions),), -torch.inf)
+        if out.strip() and out.strip()[0] in letters:
+            scores[letters.index(out.strip()[0])] = 1
+        return scores, out, tokens
+
     def get_action(
             self,
             lang_obs: Union[str, List[str]],
             lang_actions: List[str],
-            env_actions: List[List[str]],
+            env_actions: List[int],
             return_tuple: bool = False
-        ) -> Union[List[str], Tuple[List[str], str, str, int]]:
+        ) -> Union[int, Tuple[int, str, str, int]]:
 
         # Get scores for high actions
         scores, generation, tokens = self._get_score(lang_obs, lang_actions)
@@ -119,6 +170,9 @@ class ChatActor(LLMActor):
             return env_actions[lang_actions.index(lang_action)]
 
 
+LETTER_ONLY_INSTRUCTION = "\n\nAnswer with only the letter of the best action."
+
+
 NLE_EXMAPLES = [
     {
         "task_id": "MiniHack-LavaCross-Levitate-Ring-Inv-v0",
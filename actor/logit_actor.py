@@ -1,24 +1,63 @@
-from typing import List, Union, Tuple
+from typing import Dict, List, Optional, Union, Tuple
+import time
 import torch
 import random
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 
 from actor import LLMActor
+from utils.model_utils import load_mmap_model
 
 
 class LogitActor(LLMActor):
-    def __init__(self, checkpoint="google/flan-t5-xl", temperature=.1, device="cuda", **kwargs):
+    def __init__(
+            self,
+            checkpoint="google/flan-t5-xl",
+            temperature=.1,
+            device="cuda",
+            prefix_trie=False,
+            mmap_weights=False,
+            dtype: Optional[torch.dtype] = None,
+            backend="torch",
+            quantize=False,
+            **kwargs
+        ):
         super().__init__(**kwargs)
 
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(checkpoint).to(device).eval()
+        if torch.device(device).type == "cpu" and dtype == torch.float16:
+            raise ValueError("float16 matmuls are not implemented on CPU, use bfloat16 or float32")
+
+        start = time.perf_counter()
+        self.backend = backend
+        if backend == "onnx":
+            if prefix_trie:
+                raise ValueError("Prefix trie scoring needs past_key_values, which the onnx backend does not export")
+            if mmap_weights or dtype is not None:
+                raise ValueError("The onnx backend loads its own float32 export, mmap_weights and dtype only apply to torch")
+            from utils.onnx_utils import OnnxSeq2Seq
+            self.model = OnnxSeq2Seq(checkpoint, quantize=quantize)
+            device = "cpu"
+        elif backend != "torch":
+            raise ValueError("Unknown backend: {}".format(backend))
+        elif quantize:
+            raise ValueError("Int8 quantization is only implemented for the onnx backend")
+        elif mmap_weights:
+            self.model = load_mmap_model(checkpoint, dtype=dtype).to(device).eval()
+        else:
+            self.model = AutoModelForSeq2SeqLM.from_pretrained(checkpoint, torch_dtype=dtype).to(device).eval()
         self.tokenizer = AutoTokenizer.from_pretrained(
             checkpoint,
             truncation_side="left",
             padding_size="right",
             pad_token_as_eos_token=False
         )
+        self.device = torch.device(device)
+        self.load_time = time.perf_counter() - start
         self.temperature = temperature
+        self.prefix_trie = prefix_trie
         self.action_baselines = dict()
+        self.action_cache: Dict[str, torch.Tensor] = dict()
+        self.action_token_ids: Dict[str, List[int]] = dict()
+        self.timings = dict(tokenize=0., steps=0, decoder_tokens=0)
 
     def reset(self, task_description: str = ""):
         if task_description != self.task:
@@ -40,6 +79,90 @@ class LogitActor(LLMActor):
         ])
         return prompt
 
+    def encode(self, prompt_ids: torch.Tensor) -> torch.Tensor:
+        if self.backend == "onnx":
+            return self.model.encode(prompt_ids)
+        return self.model.encoder(prompt_ids, return_dict=True).last_hidden_state
+
+    def decode(self, decoder_input_ids: torch.Tensor, encoder_hidden: torch.Tensor) -> torch.Tensor:
+        if self.backend == "onnx":
+            return self.model.decode(decoder_input_ids, encoder_hidden)
+        return self.model(
+            decoder_input_ids=decoder_input_ids,
+            encoder_outputs=(encoder_hidden,),
+            return_dict=True
+        ).logits
+
+    def cache_actions(self, actions: List[str]):
+        missing = [a for a in dict.fromkeys(actions) if a not in self.action_cache]
+        if missing:
+            start = time.perf_counter()
+            ids = self.tokenizer(
+                [self.tokenizer.pad_token + a for a in missing],
+                add_special_tokens=False
+            ).input_ids
+            for a, x in zip(missing, ids):
+                self.action_token_ids[a] = x
+                self.action_cache[a] = torch.tensor(x, dtype=torch.long, device=self.device)
+            self.timings["tokenize"] += time.perf_counter() - start
+
+    def get_action_ids(self, actions: List[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+        self.cache_actions(actions)
+
+        # Scatter cached rows into a right padded batch
+        rows = [self.action_cache[a] for a in actions]
+        lengths = torch.tensor([r.shape[0] for r in rows], device=self.device)
+        positions = torch.arange(int(lengths.max()), device=self.device)
+        mask = positions.unsqueeze(0) < lengths.unsqueeze(1)
+        action_inp = torch.full(
+            mask.shape,
+            self.tokenizer.pad_token_id,
+            dtype=torch.long,
+            device=self.device
+        )
+        action_inp[mask] = torch.cat(rows)
+        return action_inp, lengths
+
+    def get_trie_score(self, encoder_hidden: torch.Tensor, actions: List[str]) -> torch.Tensor:
+        self.cache_actions(actions)
+        action_ids = [self.action_token_ids[a] for a in actions]
+        totals = torch.zeros(len(actions), device=self.device)
+        lengths = torch.tensor([len(x) - 1 for x in action_ids], device=self.device)
+
+        # Decode the prefix trie one level at a time, expanding each shared prefix once
+        past = None
+        parents = dict()
+        depth = 0
+        while True:
+            active = [i for i, x in enumerate(action_ids) if len(x) > depth + 1]
+            if not active:
+                break
+            nodes = dict()
+            for i in active:
+                nodes.setdefault(tuple(action_ids[i][:depth + 1]), len(nodes))
+
+            if past is not None:
+                parent_idx = torch.tensor([parents[p[:-1]] for p in nodes], device=self.device)
+                past = tuple(tuple(t.index_select(0, parent_idx) for t in layer) for layer in past)
+            model_out = self.model(
+                decoder_input_ids=torch.tensor([[p[-1]] for p in nodes], device=self.device),
+                encoder_outputs=(encoder_hidden.expand(len(nodes), -1, -1),),
+                past_key_values=past,
+                use_cache=True,
+                return_dict=True
+            )
+            self.timings["decoder_tokens"] += len(nodes)
+
+            rows = torch.tensor([nodes[tuple(action_ids[i][:depth + 1])] for i in active], device=self.device)
+            targets = torch.tensor([action_ids[i][depth + 1] for i in active], device=self.device)
+            totals[active] += model_out.logits[rows, -1, targets]
+
+            past = model_out.past_key_values
+            parents = nodes
+            depth += 1
+
+        return totals / lengths
+
     def get_score(
             self,
             state: Union[str, List[str]],
@@ -57,38 +180,27 @@ class LogitActor(LLMActor):
 
         with torch.no_grad():
 
+            start = time.perf_counter()
             prompt_ids = self.tokenizer(
                 self.get_actor_prompt(state, task), 
                 return_tensors="pt"
-            ).input_ids.to(self.model.device)
-            encoder_cache = (
-                self.model.encoder(prompt_ids, return_dict=True).last_hidden_state.repeat(len(actions), 1, 1),
-            )
+            ).input_ids.to(self.device)
+            self.timings["tokenize"] += time.perf_counter() - start
+            encoder_hidden = self.encode(prompt_ids)
 
-            action_inp = self.tokenizer(
-                [self.tokenizer.pad_token + a for a in actions], 
-                padding=True,
-                add_special_tokens=False,
-                return_tensors="pt"
-            ).input_ids.to(self.model.device)
-            model_out = self.model(
-                decoder_input_ids=action_inp[:, :-1],
-                encoder_outputs=encoder_cache,
-                return_dict=True
-            )
+            if self.prefix_trie:
+                score = self.get_trie_score(encoder_hidden, actions)
+            else:
+                action_inp, lengths = self.get_action_ids(actions)
+                model_logits = self.decode(action_inp[:, :-1], encoder_hidden.repeat(len(actions), 1, 1))
+                self.timings["decoder_tokens"] += action_inp[:, :-1].numel()
 
-            logits = torch.gather(model_out.logits, 2, action_inp[:, 1:].unsqueeze(-1)).squeeze(-1)
+                logits = torch.gather(model_logits, 2, action_inp[:, 1:].unsqueeze(-1)).squeeze(-1)
 
-            # Get final (non padding) states
-            score = []
-            for i in range(action_inp.shape[0]):
-                padding_idx = torch.where(action_inp[i, 1:] == self.tokenizer.pad_token_id)[0]
-                if padding_idx.shape[0]:
-                    score.append(torch.mean(logits[i, :padding_idx[0]], dim=0, keepdim=True))
-                else:
-                    score.append(torch.mean(logits[i], dim=0, keepdim=True))
+                # Mean over final (non padding) states
+                mask = torch.arange(logits.shape[1], device=logits.device).unsqueeze(0) < (lengths - 1).unsqueeze(1)
+                score = torch.sum(logits * mask, dim=1) / torch.sum(mask, dim=1)
 
-            score = torch.cat(score)
             score = score * scale - baseline
 
         return score
@@ -97,9 +209,11 @@ class LogitActor(LLMActor):
             self,
             lang_obs: Union[str, List[str]],
             lang_actions: List[str],
-            env_actions: List[List[str]],
+            env_actions: List[int],
             return_tuple: bool = False
-        ) -> Union[List[str], Tuple[List[str], str, str, int]]:
+        ) -> Union[int, Tuple[int, str, str, int]]:
+
+        self.timings["steps"] += 1
 
         # Get baseline scores for all actions
         for a in lang_actions:
@@ -108,7 +222,7 @@ class LogitActor(LLMActor):
 
         # Get scores for high actions
         baseline = torch.tensor([self.action_baselines[a] for a in lang_actions])
-        scores = self.get_score(lang_obs, lang_actions, baseline=baseline.to(self.model.device))
+        scores = self.get_score(lang_obs, lang_actions, baseline=baseline.to(self.device))
 
         if torch.all(scores == -torch.inf):
             lang_action = random.choice(lang_actions)
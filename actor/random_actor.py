@@ -9,9 +9,9 @@ class RandomActor(LLMActor):
             self,
             lang_obs: Union[str, List[str]],
             lang_actions: List[str],
-            env_actions: List[List[str]],
+            env_actions: List[int],
             return_tuple: bool = False
-        ) -> Union[List[str], Tuple[List[str], str, str, int]]:
+        ) -> Union[int, Tuple[int, str, str, int]]:
 
         action_weights = torch.tensor([1/8 if a.startswith("zap") or a.startswith("blow") else 1 for a in lang_actions])
         probs = torch.ones(len(env_actions)) * action_weights / torch.sum(action_weights)
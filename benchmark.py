@@ -0,0 +1,58 @@
+import time
+import torch
+from argparse import ArgumentParser
+
+from actor.random_actor import RandomActor
+from actor.logit_actor import LogitActor
+from envs.lang_env import LangEnv
+from utils.rollout_utils import choose_action, reset_episode, step_episode
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare per step latency and scores of seq2seq inference backends on CPU")
+    parser.add_argument("--actor", type=str, default="google/flan-t5-base", help="Path to a seq2seq huggingface model")
+    parser.add_argument("--task", type=str, default="MiniHack-Room-Monster-5x5-v0", help="Task to collect states from")
+    parser.add_argument("--num_steps", type=int, default=50, help="Number of states to score with each backend")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for collecting states")
+    parser.add_argument("--quantize", action="store_true", help="Also benchmark the dynamic int8 quantized onnx backend")
+    args = parser.parse_args()
+
+    # Collect states with a random actor so every backend scores the same inputs
+    env = LangEnv(args.task)
+    random_actor = RandomActor()
+    random_actor.reset(env.get_task())
+    states = []
+    rollout_id = 0
+    episode = reset_episode(env, rollout_id, args.seed)
+    while len(states) < args.num_steps:
+        states.append((episode["lang_obs"], list(episode["actions"][0])))
+        step_episode(env, episode, choose_action(random_actor, episode, args.seed))
+        if episode["done"]:
+            rollout_id += 1
+            episode = reset_episode(env, rollout_id, args.seed)
+
+    backends = [("torch", False), ("onnx", False)] + ([("onnx", True)] if args.quantize else [])
+    scores = dict()
+    for backend, quantize in backends:
+        name = backend + ("-int8" if quantize else "")
+        actor = LogitActor(args.actor, device="cpu", backend=backend, quantize=quantize)
+        actor.reset(env.get_task())
+        actor.get_score(*states[0])
+
+        start = time.perf_counter()
+        scores[name] = [actor.get_score(state, actions) for state, actions in states]
+        latency = (time.perf_counter() - start) / len(states)
+        print("{}: load {:.1f}s, {:.1f}ms per step".format(name, actor.load_time, 1000 * latency))
+
+        # Prefix trie scoring should reproduce the dense torch scores
+        if backend == "torch":
+            actor.prefix_trie = True
+            start = time.perf_counter()
+            scores["torch-trie"] = [actor.get_score(state, actions) for state, actions in states]
+            latency = (time.perf_counter() - start) / len(states)
+            print("torch-trie: {:.1f}ms per step".format(1000 * latency))
+
+    for name in scores:
+        if name != "torch":
+            diff = max(torch.max(torch.abs(x - y)).item() for x, y in zip(scores[name], scores["torch"]))
+            print("{}: max absolute score difference from torch {:.2e}".format(name, diff))
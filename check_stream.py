@@ -0,0 +1,86 @@
+import json
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import openai
+import time
+
+from actor.chat_actor import ChatActor
+from utils.gpt_utils import get_chat
+
+
+FILLER = [" I", " will", " keep", " moving", " towards", " the", " stairs", " after", " this", " step", "."] * 4
+
+OUTPUTS = {
+    "choice before explanation": [
+        "I", " choose", " to", ":", " B", ")", " move", " south", "east", ".",
+        " The", " stairs", " are", " to", " the", " southeast", "."
+    ] + FILLER,
+    "choice after explanation": [
+        "The", " stairs", " are", " to", " the", " southeast", ".", " ",
+        "I", " choose", " to", ":", " B", ")", " move", " south", "east", "."
+    ] + FILLER,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Replays one scripted completion token by token as server sent events
+    tokens = []
+    delay = .02
+    sent = 0
+    finished = threading.Event()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for token in self.tokens + [None]:
+                if token is None:
+                    self.wfile.write(b"data: [DONE]\n\n")
+                else:
+                    chunk = dict(choices=[dict(index=0, delta=dict(content=token))])
+                    self.wfile.write("data: {}\n\n".format(json.dumps(chunk)).encode("utf-8"))
+                self.wfile.flush()
+                type(self).sent += 1
+                time.sleep(self.delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            type(self).finished.set()
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check that streamed gpt responses stop once the chosen action is complete")
+    parser.add_argument("--delay", type=float, default=.02, help="Seconds between streamed tokens")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    openai.api_base = "http://127.0.0.1:{}/v1".format(server.server_address[1])
+    openai.api_key = "stub"
+
+    actor = ChatActor(stream=True)
+    assert not actor._find_choice("I choose to: B) move south")[1], "Committed before the action was complete"
+
+    for name, tokens in OUTPUTS.items():
+        StubHandler.tokens = tokens
+        StubHandler.delay = args.delay
+        StubHandler.sent = 0
+        StubHandler.finished = threading.Event()
+        out, _ = get_chat(["stub"], stream=True, stop_parser=lambda x: actor._find_choice(x)[1])
+        choice = actor._find_choice(out)[0]
+
+        # The server only notices the closed connection once a write fails
+        assert StubHandler.finished.wait(timeout=10), "{}: server still streaming".format(name)
+        assert choice == "move southeast", "{}: parsed {!r}".format(name, choice)
+        assert out.endswith("move southeast."), "{}: read past the choice {!r}".format(name, out)
+        assert StubHandler.sent < len(tokens), "{}: connection was not closed early".format(name)
+        print("{}: stopped at {!r}, server sent {} of {} tokens".format(
+            name, out[-len("move southeast."):], StubHandler.sent, len(tokens)
+        ))
+    server.shutdown()
@@ -1,33 +1,99 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 import gym
 from gym import Wrapper
 from nle_language_wrapper import NLELanguageWrapper
 
-from utils.nle_utils import get_admissible, get_lang_obs, TASK_TO_DESC
+from utils.nle_utils import (
+    ACTION_TABLE,
+    MacroAction,
+    get_admissible_ids,
+    get_lang_obs,
+    get_message,
+    should_interrupt,
+    TASK_TO_DESC,
+)
 
 
 class LangEnv(Wrapper):
-    def __init__(self, task: str):
+    def __init__(self, task: str, macros: bool = False):
         self.task_id = task
+        self.macros = macros
         env = gym.make(
             task,
             observation_keys=("glyphs", "blstats", "tty_chars", "inv_strs", "inv_letters", "tty_cursor")
         )
-        self.lang_to_action = NLELanguageWrapper(env).pre_step
+        lang_wrapper = NLELanguageWrapper(env)
+        self.lang_to_action = lang_wrapper.pre_step
         super().__init__(env)
-    
-    def reset(self):
+
+        # Compile the fixed ACTION_TABLE once, ids are shared by every env and entries
+        # with keys this env does not support are masked out
+        self.key_to_index = {
+            k: lang_wrapper.action_enum_index_map[e]
+            for k, e in lang_wrapper.action_str_enum_map.items()
+        }
+        self.action_table: List[Optional[Tuple[int, ...]]] = [self.compile_action(x) for x in ACTION_TABLE]
+        self.allowed = [x is not None for x in self.action_table]
+        self.macro_table: List[MacroAction] = []
+
+    def reset(self, seed: Optional[int] = None):
+        if seed is not None:
+            self.env.unwrapped.seed(seed, seed, reseed=False)
         self.last_obs = super().reset()
         obs = get_lang_obs(self.last_obs, as_list=True)
         return obs
-        
-    def step(self, action):
+
+    def step(self, action: str):
         self.last_obs, reward, done, info = super().step(self.lang_to_action(action))
         obs = get_lang_obs(self.last_obs, as_list=True)
         return obs, reward, done, info
-    
-    def get_actions(self) -> Tuple[List[str], List[List[str]]]:
-        return get_admissible(self.last_obs, allowed=self.env.actions)
-        
+
+    def step_id(self, action_id: int, max_steps: Optional[int] = None):
+        # Runs every key of an action id from get_actions, macro plans stop early once
+        # something new happens. Returns the summed reward and the number of keys run
+        keys = self.get_keys(action_id)
+        is_macro = isinstance(keys, MacroAction)
+        total_reward, steps = 0, 0
+        for a in keys:
+            message = get_message(self.last_obs) if is_macro else ""
+            self.last_obs, reward, done, info = super().step(a)
+            total_reward += reward
+            steps += 1
+            if done or (max_steps is not None and steps >= max_steps):
+                break
+            if is_macro and should_interrupt(self.last_obs, message):
+                break
+        obs = get_lang_obs(self.last_obs, as_list=True)
+        return obs, total_reward, done, info, steps
+
+    def compile_action(self, env_action: List[str]) -> Optional[Tuple[int, ...]]:
+        if not all(a in self.key_to_index for a in env_action):
+            return None
+        return tuple(self.key_to_index[a] for a in env_action)
+
+    def get_actions(self) -> Tuple[List[str], List[int]]:
+        lang_actions, action_ids = [], []
+
+        # Macro plans change every step so they go in a table that only lives until
+        # the next call, their ids are negative with ~id indexing that table
+        self.macro_table = []
+        for lang_action, action_id in zip(*get_admissible_ids(self.last_obs, macros=self.macros)):
+            if isinstance(action_id, MacroAction):
+                compiled = self.compile_action(action_id)
+                if compiled is None:
+                    continue
+                self.macro_table.append(MacroAction(compiled))
+                action_id = ~(len(self.macro_table) - 1)
+            elif not self.allowed[action_id]:
+                continue
+            lang_actions.append(lang_action)
+            action_ids.append(action_id)
+        return lang_actions, action_ids
+
+    def get_keys(self, action_id: int) -> Union[Tuple[int, ...], MacroAction]:
+        if action_id < 0:
+            return self.macro_table[~action_id]
+        return self.action_table[action_id]
+
     def get_task(self) -> str:
         return TASK_TO_DESC[self.task_id]
@@ -0,0 +1,21 @@
+from argparse import ArgumentParser
+
+from utils.shard_utils import merge_shards, write_json
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Merge sharded rollout results")
+    parser.add_argument("--exp_name", type=str, default="test", help="File name used for the sharded rollouts")
+    args = parser.parse_args()
+
+    results = merge_shards(args.exp_name)
+    write_json(args.exp_name + ".json", results)
+    for task, result in results.items():
+        print("{}: success {:.3f} ({:.3f}-{:.3f}), death {:.3f}, reward {:.3f} over {} episodes".format(
+            task,
+            result["success"],
+            *result["success_interval"],
+            result["death"],
+            result["reward"],
+            result["num_episodes"]
+        ))
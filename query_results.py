@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+
+from utils.results_db import ResultsDB
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Query rollout results stored with --db")
+    parser.add_argument("--db", type=str, default="results.db", help="Results database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    leaderboard_parser = subparsers.add_parser("leaderboard", help="Best complete runs per task, shards of an experiment are ranked together")
+    leaderboard_parser.add_argument("--task", type=str, default="", help="Task to rank runs on, default is all tasks")
+    leaderboard_parser.add_argument("--limit", type=int, default=20, help="Number of runs to show per task")
+    diff_parser = subparsers.add_parser("diff", help="Compare two runs per task")
+    diff_parser.add_argument("run_a", type=int, help="First run id")
+    diff_parser.add_argument("run_b", type=int, help="Second run id")
+    args = parser.parse_args()
+
+    db = ResultsDB(args.db)
+    if args.command == "leaderboard":
+        task = None
+        for row in db.get_leaderboard(args.task or None, args.limit):
+            if row["task"] != task:
+                task = row["task"]
+                print("\n" + task)
+            print("  run {:>5} shards {:>3} {:<24} {:<32} success {:.3f} death {:.3f} reward {:.3f} episodes {:>6} time {:.1f}s tokens {:.0f}".format(
+                row["run_id"],
+                row["num_shards"],
+                row["exp_name"][:24],
+                row["actor"][:32],
+                row["success"],
+                row["death"],
+                row["reward"],
+                row["num_episodes"],
+                row["wall_time"],
+                row["tokens"]
+            ))
+    else:
+        config_a, config_b = db.get_config(args.run_a), db.get_config(args.run_b)
+        for key in sorted(set(config_a) | set(config_b)):
+            if config_a.get(key) != config_b.get(key):
+                print("{}: {} -> {}".format(key, config_a.get(key), config_b.get(key)))
+        fmt = lambda x: "-" if x is None else "{:.3f}".format(x)
+        for task, success_a, success_b, reward_a, reward_b in db.get_diff(args.run_a, args.run_b):
+            print("{:<48} success {} -> {} reward {} -> {}".format(task, fmt(success_a), fmt(success_b), fmt(reward_a), fmt(reward_b)))
+    db.close()
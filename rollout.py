@@ -1,12 +1,27 @@
-import json
+import time
+import torch
 from tqdm import tqdm
 from argparse import ArgumentParser
 
 from actor.random_actor import RandomActor
-from actor.chat_actor import ChatActor
+from actor.chat_actor import ChatActor, NLE_EXMAPLES
 from actor.logit_actor import LogitActor
 from envs.lang_env import LangEnv
 from utils.nle_utils import TASK_TO_DESC
+from utils.fewshot_utils import FewshotStore, harvest_examples, save_examples
+from utils.rollout_utils import run_pipelined, run_sequential
+from utils.results_db import ResultsDB
+from utils.shard_utils import (
+    get_episode_record,
+    get_jobs,
+    get_result_config,
+    get_shard,
+    get_shard_path,
+    parse_shard,
+    summarize_episodes,
+    write_json,
+    write_manifest,
+)
 
 
 if __name__ == "__main__":
@@ -16,75 +31,140 @@ if __name__ == "__main__":
     parser.add_argument("--actor", type=str, default="random", help="Can be random, gpt, or a path to a seq2seq huggingface model")
     parser.add_argument("--num_rollouts", type=int, default=10, help="Number of rollouts to evaluate")
     parser.add_argument("--max_episode_steps", type=int, default=None, help="Max episode steps")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for environments and action sampling, default is unseeded")
+    parser.add_argument("--pipeline", type=int, default=1, help="Number of concurrent episodes stepped while the actor runs, 1 runs episodes sequentially")
+    parser.add_argument("--macros", action="store_true", help="Add pathfinding actions that go to the stairs, items and monsters")
+    parser.add_argument("--db", type=str, default="", help="SQLite file to record the run and its episodes in, query with query_results.py")
+    parser.add_argument("--db_wal", action="store_true", help="Use write ahead logging so results can be queried during the run, the db must be on a local disk")
+    parser.add_argument("--shard", type=str, default="", help="Run only shard i/N of the jobs, needs --seed, merge shards with merge_shards.py")
     parser.add_argument("--fewshot", type=int, default=4, help="How many fewshot examples to use for gpt")
+    parser.add_argument("--stream", action="store_true", help="Stream gpt responses and stop once the chosen action is complete")
+    parser.add_argument("--retrieve", action="store_true", help="Select the most similar fewshot examples for each step instead of the first ones")
+    parser.add_argument("--fewshot_file", type=str, default="", help="Jsonl file of extra fewshot examples for retrieval")
+    parser.add_argument("--harvest_file", type=str, default="", help="Jsonl file to append steps of successful episodes to as fewshot examples, pass it as --fewshot_file to later runs")
     parser.add_argument("--action_temp", type=float, default=1, help="Sampling temperature for action policy")
     parser.add_argument("--cot", action="store_true", help="Use explanaitons for actor")
+    parser.add_argument("--letter", action="store_true", help="Answer with only the option letter for gpt actor, can not be combined with --cot")
+    parser.add_argument("--prefix_trie", action="store_true", help="Score seq2seq actions by decoding their shared prefixes once")
+    parser.add_argument("--mmap_weights", action="store_true", help="Load seq2seq weights from a memory mapped cache shared between processes")
+    parser.add_argument("--dtype", type=str, default=None, choices=["float32", "float16", "bfloat16"], help="Cast seq2seq weights at load time, float16 needs a GPU")
+    parser.add_argument("--backend", type=str, default="torch", choices=["torch", "onnx"], help="Inference backend for seq2seq actor, onnx runs on CPU")
+    parser.add_argument("--quantize", action="store_true", help="Use dynamic int8 quantization with the onnx backend")
     parser.add_argument("--cpu", action="store_true", help="Use CPU instead of GPU")
     args = parser.parse_args()
+    if args.cpu and args.dtype == "float16":
+        parser.error("--dtype float16 is not supported with --cpu, use bfloat16 or float32")
+    if args.fewshot_file and not args.retrieve:
+        parser.error("--fewshot_file is only used with --retrieve")
+    if args.shard and args.seed is None:
+        parser.error("--shard needs --seed so every node expands the same jobs")
 
     device = "cpu" if args.cpu else "cuda"
 
     if args.actor == "random":
         actor = RandomActor()
     elif args.actor == "gpt":
-        actor = ChatActor(fewshot=args.fewshot, use_cot=args.cot)
+        fewshot_store = None
+        if args.retrieve:
+            fewshot_store = FewshotStore(NLE_EXMAPLES)
+            if args.fewshot_file:
+                fewshot_store.load(args.fewshot_file)
+        actor = ChatActor(
+            fewshot=args.fewshot,
+            use_cot=args.cot,
+            letter_only=args.letter,
+            fewshot_store=fewshot_store,
+            stream=args.stream
+        )
     else:
-        actor = LogitActor(args.actor, temperature=args.action_temp)
+        actor = LogitActor(
+            args.actor,
+            temperature=args.action_temp,
+            device=device,
+            prefix_trie=args.prefix_trie,
+            mmap_weights=args.mmap_weights,
+            dtype=getattr(torch, args.dtype) if args.dtype else None,
+            backend=args.backend,
+            quantize=args.quantize
+        )
+        print("Loaded {} in {:.1f}s".format(args.actor, actor.load_time))
 
     if args.task:
         tasks = [args.task]
     else:
         tasks = TASK_TO_DESC.keys()
 
-    results = {
-        x: dict(reward=0, success=0, death=0) 
-        for x in tasks
-    }
-    
+    jobs = get_jobs(list(tasks), args.num_rollouts, args.seed, get_result_config(vars(args)))
+    shard_idx, num_shards = parse_shard(args.shard) if args.shard else (0, 1)
+    if args.shard:
+        write_manifest(args.exp_name + ".manifest.json", jobs, num_shards)
+    shard_jobs = get_shard(jobs, shard_idx, num_shards)
+    job_ids = {(x["task"], x["rollout_id"]): x["job_id"] for x in shard_jobs}
+    records = []
+    if args.db:
+        db = ResultsDB(args.db, wal=args.db_wal)
+        run_id = db.add_run(args.exp_name, args.actor, args.num_rollouts, vars(args), shard_idx, num_shards)
+
     for task in tasks:
-        env = LangEnv(task)
+        rollout_ids = [x["rollout_id"] for x in shard_jobs if x["task"] == task]
+        if not rollout_ids:
+            continue
 
         print("Starting Task:", task)
-        pbar = tqdm(range(args.num_rollouts))
-        for rollout_id in range(args.num_rollouts):
-
-            lang_obs_list = env.reset()
-            description = env.get_task()
-
-            actor.reset(description)
-            cum_reward = 0
-            steps = 0
-            done = False
-            while not done:
-
-                lang_actions, env_actions = env.get_actions()
-
-                env_action = actor.get_action(
-                    lang_obs_list, 
-                    lang_actions, 
-                    env_actions, 
-                    return_tuple=False
-                )
-
-                if not isinstance(env_action, list):
-                    env_action = [env_action]
-                for a in env_action:
-                    lang_obs_list, reward, done, info = env.step(a)
-                    cum_reward += reward
-                    steps += 1
-                    if done:
-                        break
-
-                if args.max_episode_steps is not None and steps >= args.max_episode_steps:
-                    done = True
-
-            results[task]["reward"] += cum_reward / args.num_rollouts
-            if reward > 0:
-                results[task]["success"] += 1 / args.num_rollouts
-            elif "end_status" in info and info["end_status"] == 1:
-                results[task]["death"] += 1 / args.num_rollouts
+        pbar = tqdm(range(len(rollout_ids)))
+        timings = dict(env=0., actor=0., decisions=0, successes=0)
+
+        def on_episode(episode):
+            records.append(get_episode_record(job_ids[(task, episode["rollout_id"])], task, episode))
+            if args.db:
+                db.add_episode(run_id, records[-1])
+            if args.harvest_file and episode["reward"] > 0:
+                examples = harvest_examples(task, episode["trajectory"])
+                if getattr(actor, "fewshot_store", None) is not None:
+                    # Retrieval picks up new examples for the rest of this run
+                    examples = actor.fewshot_store.add(examples)
+                save_examples(args.harvest_file, examples)
+            timings["env"] += episode["env_time"]
+            timings["actor"] += episode["actor_time"]
+            timings["decisions"] += episode["decisions"]
+            timings["successes"] += records[-1]["success"]
             pbar.update(1)
-            pbar.set_description("Successes {}/{}".format(int(results[task]["success"] * args.num_rollouts), rollout_id + 1))
-
-        with open(args.exp_name + ".json", "w") as f:
-            json.dump(results, f, indent=4)
+            pbar.set_description("Successes {}/{}".format(timings["successes"], pbar.n))
+
+        start = time.perf_counter()
+        envs = [LangEnv(task, macros=args.macros) for _ in range(min(args.pipeline, len(rollout_ids)))]
+        try:
+            if args.pipeline > 1:
+                run_pipelined(envs, actor, rollout_ids, on_episode, args.seed, args.max_episode_steps)
+            else:
+                run_sequential(envs[0], actor, rollout_ids, on_episode, args.seed, args.max_episode_steps)
+        finally:
+            # Every env holds its own nethack instance and temporary directory
+            for env in envs:
+                env.close()
+        pbar.close()
+        print("Wall time: {:.1f}s, env time: {:.1f}s, actor time: {:.1f}s, decisions per episode: {:.1f}".format(
+            time.perf_counter() - start,
+            timings["env"],
+            timings["actor"],
+            timings["decisions"] / len(rollout_ids)
+        ))
+
+        if hasattr(actor, "timings") and actor.timings["steps"]:
+            print("Tokenizer time per step: {:.2f}ms, decoder tokens per step: {:.1f}".format(
+                1000 * actor.timings["tokenize"] / actor.timings["steps"],
+                actor.timings["decoder_tokens"] / actor.timings["steps"]
+            ))
+
+        if args.db:
+            db.flush()
+        if args.shard:
+            write_json(get_shard_path(args.exp_name, shard_idx, num_shards), dict(
+                shard=args.shard,
+                episodes=records
+            ))
+        else:
+            write_json(args.exp_name + ".json", summarize_episodes(records, list(tasks)))
+
+    if args.db:
+        db.close()
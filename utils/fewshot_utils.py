@@ -0,0 +1,126 @@
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+import json
+import math
+from collections import Counter
+import torch
+
+from utils.nle_utils import TASK_TO_DESC
+
+
+def get_terms(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def get_example_key(example: Dict[str, Any]) -> Tuple[str, Tuple[str, ...], str]:
+    return example["task_id"], tuple(example["state"]), example["action"]
+
+
+def get_example_text(task: str, state: List[str], admissible: List[str]) -> str:
+    return "\n".join([task] + list(state) + list(admissible))
+
+
+class FewshotStore:
+    def __init__(self, examples: Optional[List[Dict[str, Any]]] = None):
+        self.examples = []
+        self.keys = set()
+        self.vocab = dict()
+        # Term frequencies are tokenized once per added batch, build only reweights them
+        self.rows, self.cols, self.tfs = [], [], []
+        self.idf = None
+        self.matrix = None
+        if examples:
+            self.add(examples)
+
+    def add(self, examples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Returns the examples that were not already in the store
+        added = []
+        for example in examples:
+            key = get_example_key(example)
+            if key not in self.keys:
+                self.keys.add(key)
+                added.append(example)
+        if added:
+            rows, cols, tfs = [], [], []
+            for i, example in enumerate(added, len(self.examples)):
+                text = get_example_text(TASK_TO_DESC[example["task_id"]], example["state"], example["admissible"])
+                for term, count in Counter(get_terms(text)).items():
+                    rows.append(i)
+                    cols.append(self.vocab.setdefault(term, len(self.vocab)))
+                    tfs.append(1 + math.log(count))
+            self.examples.extend(added)
+            self.rows.append(torch.tensor(rows, dtype=torch.long))
+            self.cols.append(torch.tensor(cols, dtype=torch.long))
+            self.tfs.append(torch.tensor(tfs, dtype=torch.float32))
+            self.matrix = None
+        return added
+
+    def load(self, path: str):
+        with open(path) as f:
+            self.add([json.loads(line) for line in f if line.strip()])
+
+    def build(self):
+        rows, cols, tfs = torch.cat(self.rows), torch.cat(self.cols), torch.cat(self.tfs)
+        self.rows, self.cols, self.tfs = [rows], [cols], [tfs]
+        doc_freq = torch.bincount(cols, minlength=len(self.vocab)).float()
+        self.idf = torch.log((1 + len(self.examples)) / (1 + doc_freq)) + 1
+
+        # Row normalized tf-idf so a single sparse matmul gives cosine similarity
+        values = tfs * self.idf[cols]
+        norms = torch.zeros(len(self.examples)).index_add_(0, rows, values ** 2).sqrt()
+        values = values / norms[rows]
+        self.matrix = torch.sparse_coo_tensor(
+            torch.stack([rows, cols]),
+            values,
+            (len(self.examples), len(self.vocab))
+        ).coalesce().to_sparse_csr()
+
+    def query(self, task: str, state: List[str], admissible: List[str], k: int) -> List[Dict[str, Any]]:
+        if k <= 0 or not self.examples:
+            return []
+        if self.matrix is None:
+            self.build()
+
+        query = torch.zeros(len(self.vocab))
+        for term, count in Counter(get_terms(get_example_text(task, state, admissible))).items():
+            if term in self.vocab:
+                query[self.vocab[term]] = 1 + math.log(count)
+        query *= self.idf
+        query /= torch.clamp(torch.linalg.norm(query), min=1e-8)
+
+        scores = torch.mm(self.matrix, query.unsqueeze(1)).squeeze(1)
+        top = torch.topk(scores, min(k, len(self.examples))).indices.tolist()
+
+        # Most similar example goes last, closest to the current turn
+        return [self.examples[i] for i in reversed(top)]
+
+
+def harvest_examples(task_id: str, trajectory: List[Dict[str, Any]], max_examples: int = 8) -> List[Dict[str, Any]]:
+    # Long episodes repeat the same states, keep each decision once and cap
+    # how many one episode contributes so it can't crowd out the rest
+    examples, keys = [], set()
+    for step in trajectory:
+        if len(examples) >= max_examples:
+            break
+        example = dict(
+            task_id=task_id,
+            state=list(step["state"]),
+            admissible=list(step["admissible"]),
+            action=step["action"],
+        )
+        explanation_end = step["generation"].find("I choose to:")
+        if explanation_end > 0:
+            example["act_explanation"] = step["generation"][:explanation_end].strip()
+        if get_example_key(example) not in keys:
+            keys.add(get_example_key(example))
+            examples.append(example)
+    return examples
+
+
+def save_examples(path: str, examples: List[Dict[str, Any]]):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        for example in examples:
+            f.write(json.dumps(example) + "\n")
@@ -1,13 +1,82 @@
-from typing import Tuple, List
+from typing import Any, Callable, Dict, Tuple, List, Optional
 import os
+import json
 import openai
+import requests
+import tiktoken
 import time
-from openai.error import ServiceUnavailableError, RateLimitError, APIError, InvalidRequestError
+from openai.error import OpenAIError, ServiceUnavailableError, RateLimitError, APIError, InvalidRequestError
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 
-def get_chat(turns: List[str], max_len: int = 200, max_tries: int = 100, system_message: str = "") -> Tuple[str, int]:
+def get_letter_token(letter: str) -> int:
+    tokens = tiktoken.get_encoding("cl100k_base").encode(letter)
+    assert len(tokens) == 1, "{} is not a single token".format(letter)
+    return tokens[0]
+
+
+def get_num_tokens(messages: List[Dict[str, str]]) -> int:
+    # Chat formatting overhead follows the openai cookbook count for gpt-3.5-turbo
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return 3 + sum(3 + sum(len(encoding.encode(v)) for v in m.values()) for m in messages)
+
+
+def get_stream_error(response: requests.Response) -> OpenAIError:
+    if response.status_code == 429:
+        return RateLimitError(response.text, http_status=response.status_code)
+    if response.status_code == 503:
+        return ServiceUnavailableError(response.text, http_status=response.status_code)
+    if 400 <= response.status_code < 500:
+        return InvalidRequestError(response.text, None, http_status=response.status_code)
+    return APIError(response.text, http_status=response.status_code)
+
+
+def stream_chat(request: Dict[str, Any], stop_parser: Optional[Callable[[str], bool]] = None) -> Tuple[str, int]:
+    # Streams with requests directly so the http response can be closed as soon as
+    # the parser has what it needs, each server sent event carries one token
+    out, completion_tokens = "", 0
+    try:
+        with requests.post(
+            openai.api_base.rstrip("/") + "/chat/completions",
+            headers=dict(Authorization="Bearer {}".format(openai.api_key)),
+            json=dict(request, stream=True),
+            stream=True,
+            timeout=600
+        ) as response:
+            if response.status_code != 200:
+                raise get_stream_error(response)
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                if line == b"data: [DONE]":
+                    break
+                event = json.loads(line[len(b"data: "):])
+                if "error" in event:
+                    raise APIError(json.dumps(event["error"]), json_body=event)
+                if not event.get("choices"):
+                    continue
+                content = event["choices"][0].get("delta", dict()).get("content", "")
+                if content:
+                    out += content
+                    completion_tokens += 1
+                    if stop_parser is not None and stop_parser(out):
+                        break
+    except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        # Dropped connections, timeouts and truncated events are retried like api errors
+        raise APIError("Stream failed: {}".format(e)) from e
+    return out, completion_tokens
+
+
+def get_chat(
+        turns: List[str],
+        max_len: int = 200,
+        max_tries: int = 100,
+        system_message: str = "",
+        logit_bias: Optional[Dict[int, float]] = None,
+        stream: bool = False,
+        stop_parser: Optional[Callable[[str], bool]] = None
+    ) -> Tuple[str, int]:
 
     num_tries = 0
     while True:
@@ -15,15 +84,20 @@ def get_chat(turns: List[str], max_len: int = 200, max_tries: int = 100, system_
             messages = [dict(role="system", content=system_message)] if system_message else []
             for i, content in enumerate(turns):
                 messages.append(dict(role="user" if i % 2 == 0 else "assistant", content=content))
-            response = openai.ChatCompletion.create(
+            request = dict(
                 model="gpt-3.5-turbo",
                 messages=messages,
                 temperature=.7,
                 max_tokens=max_len,
                 top_p=1,
                 frequency_penalty=0,
-                presence_penalty=0
+                presence_penalty=0,
+                **(dict(logit_bias=logit_bias) if logit_bias else dict())
             )
+            if stream:
+                out, completion_tokens = stream_chat(request, stop_parser)
+                return out, get_num_tokens(messages) + completion_tokens
+            response = openai.ChatCompletion.create(**request)
             return response.choices[0].message.content, response.usage.total_tokens
         except ServiceUnavailableError as e:
             print("ServiceUnavailableError:", e)
@@ -0,0 +1,137 @@
+from typing import Dict, Optional
+import os
+import re
+import glob
+import json
+import hashlib
+import struct
+from itertools import chain
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForSeq2SeqLM
+
+
+MMAP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nethack-llm", "mmap")
+
+
+# weights.mmap layout: an 8 byte little endian header length, a json header padded
+# with spaces, then the tensor data. The header maps every tensor name to its dtype,
+# shape and [begin, end) byte offsets into the data, which start on 64 byte boundaries
+# with unused gaps between tensors, so the file is not a valid safetensors file.
+# Tied weights are stored once and listed under "__metadata__" as aliases.
+MMAP_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+TORCH_DTYPES = {v: k for k, v in MMAP_DTYPES.items()}
+
+
+def get_cache_dir(checkpoint: str, cache_dir: str, dtype: Optional[torch.dtype] = None) -> str:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "--", checkpoint.strip("/"))
+    if dtype is not None:
+        name += "-" + str(dtype).replace("torch.", "")
+
+    # Local checkpoints can be retrained in place, so key on their weight files too
+    if os.path.isdir(checkpoint):
+        stamp = hashlib.sha1()
+        for path in sorted(glob.glob(os.path.join(checkpoint, "*.bin")) + glob.glob(os.path.join(checkpoint, "*.safetensors"))):
+            stat = os.stat(path)
+            stamp.update("{}:{}:{}".format(os.path.basename(path), stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+        name += "-" + stamp.hexdigest()[:12]
+    return os.path.join(cache_dir, name)
+
+
+def save_mmap_weights(model: torch.nn.Module, path: str, alignment: int = 64):
+    # Tied weights are written once and recorded as aliases in the metadata
+    header, aliases, tensors = dict(), dict(), []
+    seen = dict()
+    offset = 0
+    for name, tensor in model.state_dict().items():
+        key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))
+        if key in seen:
+            aliases[name] = seen[key]
+            continue
+        seen[key] = name
+        data = tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy()
+        offset += -offset % alignment
+        header[name] = dict(
+            dtype=MMAP_DTYPES[tensor.dtype],
+            shape=list(tensor.shape),
+            data_offsets=[offset, offset + data.nbytes]
+        )
+        tensors.append((offset, data))
+        offset += data.nbytes
+    header["__metadata__"] = dict(aliases=json.dumps(aliases))
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(8 + len(header_bytes)) % alignment)
+    tmp_path = path + ".tmp{}".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        start = f.tell()
+        for tensor_offset, data in tensors:
+            f.seek(start + tensor_offset)
+            f.write(data.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_mmap_weights(path: str) -> Dict[str, torch.Tensor]:
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    aliases = json.loads(header.pop("__metadata__", dict()).get("aliases", "{}"))
+
+    # Copy-on-write mapping, pages stay shared between processes until written
+    buffer = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_len)
+    weights = dict()
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        weights[name] = torch.from_numpy(buffer[begin:end]).view(TORCH_DTYPES[info["dtype"]]).view(info["shape"])
+    for name, target in aliases.items():
+        weights[name] = weights[target]
+    return weights
+
+
+def load_mmap_model(
+        checkpoint: str,
+        dtype: Optional[torch.dtype] = None,
+        cache_dir: str = MMAP_CACHE_DIR
+    ) -> torch.nn.Module:
+
+    mmap_dir = get_cache_dir(checkpoint, cache_dir, dtype)
+    weights_path = os.path.join(mmap_dir, "weights.mmap")
+    if not os.path.exists(weights_path):
+        model = AutoModelForSeq2SeqLM.from_pretrained(checkpoint, torch_dtype=dtype)
+        os.makedirs(mmap_dir, exist_ok=True)
+        model.config.save_pretrained(mmap_dir)
+        save_mmap_weights(model, weights_path)
+        del model
+
+    config = AutoConfig.from_pretrained(mmap_dir)
+    with torch.device("meta"):
+        model = AutoModelForSeq2SeqLM.from_config(config, torch_dtype=dtype)
+
+    for name, tensor in load_mmap_weights(weights_path).items():
+        module_name, _, attr = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attr in module._parameters:
+            module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[attr] = tensor
+    model.tie_weights()
+
+    missing = [n for n, t in chain(model.named_parameters(), model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ValueError("Weights missing from {}: {}".format(weights_path, ", ".join(missing)))
+    return model
+
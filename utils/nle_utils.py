@@ -1,4 +1,7 @@
-from typing import Dict, Union, List, Tuple
+from typing import Dict, FrozenSet, Union, List, Optional, Tuple
+import string
+from collections import deque
+from functools import lru_cache
 from itertools import chain
 import numpy as np
 from nle import nethack
@@ -11,6 +14,34 @@ from nle_language_wrapper.nle_language_obsv import NLELanguageObsv
 NLE_LANG = NLELanguageObsv()
 
 
+COMPASS_OFFSETS = {
+    "north": (0, -1),
+    "south": (0, 1),
+    "east": (1, 0),
+    "west": (-1, 0),
+    "northwest": (-1, -1),
+    "northeast": (1, -1),
+    "southwest": (-1, 1),
+    "southeast": (1, 1),
+}
+
+
+COMPASS_ACTIONS = list(COMPASS_OFFSETS)
+COMPASS_INDEX = {x: i for i, x in enumerate(COMPASS_ACTIONS)}
+
+
+MONSTER_NAMES = [nethack.permonst(m).mname for m in range(nethack.NUMMONS)]
+OBJECT_NAMES = [nethack.OBJ_NAME(nethack.objclass(i)) for i in range(nethack.NUM_OBJECTS)]
+BOULDER_GLYPH = nethack.GLYPH_OBJ_OFF + OBJECT_NAMES.index("boulder")
+
+
+# Screen symbols from NetHack's rm.h
+S_ROOM = 19
+S_DNSTAIR = 24
+OPEN_DOOR_CMAP = [13, 14]
+PASSABLE_CMAP = [12, 13, 14, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 33, 35, 36]
+
+
 TASK_TO_DESC = {
     "MiniHack-Room-5x5-v0": "navigate to the stairs down.",
     "MiniHack-Room-15x15-v0": "navigate to the stairs down.",
@@ -112,75 +143,233 @@ def get_item_key(obs, item):
     return None
     
 
-def get_admissible(obs, allowed=ACTIONS) -> Tuple[List[str], List[List[str]]]:
-    compass_actions = [
-        "north",
-        "south",
-        "east",
-        "west",
-        "northwest",
-        "northeast",
-        "southwest",
-        "southeast",
-    ]
-    lang_actions = ["move " + x for x in compass_actions]
-    env_actions = compass_actions.copy()
+class MacroAction(list):
+    # Single step moves planned toward a goal, stopped early by should_interrupt
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_glyph_name(glyph: int) -> str:
+    # Describe the glyph alone on a lit floor so the name matches the vision text
+    glyphs = np.full(nethack.DUNGEON_SHAPE, nethack.GLYPH_CMAP_OFF + S_ROOM, dtype=np.int16)
+    glyphs[1, 2] = glyph
+    blstats = np.zeros(nethack.BLSTATS_SHAPE, dtype=np.int64)
+    blstats[0], blstats[1] = 1, 1
+    for line in NLE_LANG.text_glyphs(glyphs, blstats).decode("latin-1").split("\n"):
+        if line.endswith(" adjacent east"):
+            return line[:-len(" adjacent east")]
+    return ""
+
+
+def get_blocking(glyphs: np.ndarray) -> np.ndarray:
+    # Objects that can't be walked onto, they are reached from an adjacent square
+    return (glyphs == BOULDER_GLYPH) | nethack.glyph_is_statue(glyphs)
+
+
+def get_paths(obs) -> Dict[Tuple[int, int], Tuple[Tuple[int, int], str]]:
+    glyphs = obs["glyphs"]
+    x, y = int(obs["blstats"][0]), int(obs["blstats"][1])
+    cmap = glyphs.astype(np.int64) - nethack.GLYPH_CMAP_OFF
+    # Known floor and items only, so walls, lava, water, traps, monsters, boulders and statues are avoided
+    passable = (np.isin(cmap, PASSABLE_CMAP) | nethack.glyph_is_object(glyphs)) & ~get_blocking(glyphs)
+    open_door = np.isin(cmap, OPEN_DOOR_CMAP)
+
+    parents = {(x, y): None}
+    queue = deque([(x, y)])
+    while queue:
+        cx, cy = queue.popleft()
+        for direction, (dx, dy) in COMPASS_OFFSETS.items():
+            nx, ny = cx + dx, cy + dy
+            if not (0 <= nx < glyphs.shape[1] and 0 <= ny < glyphs.shape[0]):
+                continue
+            if (nx, ny) in parents or not passable[ny, nx]:
+                continue
+            if dx and dy and (open_door[cy, cx] or open_door[ny, nx]):
+                continue
+            parents[(nx, ny)] = ((cx, cy), direction)
+            queue.append((nx, ny))
+    return parents
+
+
+def get_path(parents, goal: Tuple[int, int]) -> List[str]:
+    path = []
+    while parents[goal] is not None:
+        goal, direction = parents[goal]
+        path.append(direction)
+    return path[::-1]
+
+
+def get_macro_actions(obs) -> Tuple[List[str], List[MacroAction]]:
+    glyphs = obs["glyphs"]
+    x, y = int(obs["blstats"][0]), int(obs["blstats"][1])
+    parents = get_paths(obs)
+
+    # Shortest path to the nearest target of each name, monsters, boulders and
+    # statues are reached when adjacent
+    plans = dict()
+    is_monster = nethack.glyph_is_monster(glyphs)
+    is_adjacent_target = is_monster | get_blocking(glyphs)
+    targets = (glyphs == nethack.GLYPH_CMAP_OFF + S_DNSTAIR) | nethack.glyph_is_object(glyphs) | is_monster
+    for ty, tx in zip(*np.nonzero(targets)):
+        if (tx, ty) == (x, y):
+            continue
+        if is_adjacent_target[ty, tx]:
+            goals = [(tx + dx, ty + dy) for dx, dy in COMPASS_OFFSETS.values() if (tx + dx, ty + dy) in parents]
+        else:
+            goals = [(tx, ty)] if (tx, ty) in parents else []
+        if not goals:
+            continue
+        path = min((get_path(parents, g) for g in goals), key=len)
+        name = get_glyph_name(int(glyphs[ty, tx]))
+        if name and len(path) > 1 and (name not in plans or len(path) < len(plans[name])):
+            plans[name] = path
+
+    return ["go to the " + name for name in plans], [MacroAction(path) for path in plans.values()]
+
+
+def should_interrupt(obs, previous_message: str) -> bool:
+    message = get_message(obs)
+    if message and message != previous_message:
+        return True
+    glyphs = obs["glyphs"]
+    x, y = int(obs["blstats"][0]), int(obs["blstats"][1])
+    for dx, dy in COMPASS_OFFSETS.values():
+        if 0 <= x + dx < glyphs.shape[1] and 0 <= y + dy < glyphs.shape[0]:
+            if nethack.glyph_is_monster(glyphs[y + dy, x + dx]):
+                return True
+    return False
+
+
+@lru_cache(maxsize=None)
+def _get_allowed_keys(allowed: Tuple) -> FrozenSet[str]:
+    return frozenset(chain.from_iterable(l for e, l in NLELanguageWrapper.all_nle_action_map.items() if e in allowed))
+
+
+def get_allowed_keys(allowed) -> FrozenSet[str]:
+    if isinstance(allowed, frozenset):
+        return allowed
+    return _get_allowed_keys(tuple(allowed))
+
+
+ITEM_LETTERS = string.ascii_letters
+ITEM_LETTER_INDEX = {x: i for i, x in enumerate(ITEM_LETTERS)}
+
+
+def get_action_table() -> Tuple[List[List[str]], Dict[str, int]]:
+    # Every action an env can take, in a fixed order so ids mean the same in every env.
+    # Verbs own a block of ids indexed by monster or inventory letter, then direction
+    table, offsets = [], dict()
+
+    def add_block(verb, keys):
+        offsets[verb] = len(table)
+        table.extend(keys)
+
+    add_block("move", [[d] for d in COMPASS_ACTIONS])
+    add_block("attack", [[d] for _ in MONSTER_NAMES for d in COMPASS_ACTIONS])
+    add_block("use key", [["a"]])
+    add_block("pick up", [[","]])
+    add_block("zap", [["z", k, d] for k in ITEM_LETTERS for d in COMPASS_ACTIONS])
+    add_block("eat", [["e", k] for k in ITEM_LETTERS])
+    add_block("wear", [["W", k] for k in ITEM_LETTERS])
+    add_block("drink", [["q", k] for k in ITEM_LETTERS])
+    add_block("put on", [["P", k, "r"] for k in ITEM_LETTERS])
+    add_block("blow horn", [["a", k, "y", d] for k in ITEM_LETTERS for d in COMPASS_ACTIONS])
+    return table, offsets
+
+
+ACTION_TABLE, ACTION_OFFSETS = get_action_table()
+
+
+def get_table_id(verb: str, index: int = 0, direction: Optional[str] = None) -> int:
+    if direction is None:
+        return ACTION_OFFSETS[verb] + index
+    return ACTION_OFFSETS[verb] + index * len(COMPASS_ACTIONS) + COMPASS_INDEX[direction]
+
+
+def get_item_letter(obs, item: str) -> Tuple[Optional[int], str]:
+    key = get_item_key(obs, item)
+    if key not in ITEM_LETTER_INDEX:
+        return None, ""
+    return ITEM_LETTER_INDEX[key], get_item_name(obs, key)
+
+
+MOVE_LANG_ACTIONS = ["move " + x for x in COMPASS_ACTIONS]
+MOVE_IDS = [get_table_id("move", direction=x) for x in COMPASS_ACTIONS]
+
+
+def get_admissible_ids(obs, macros: bool = False) -> Tuple[List[str], List[Union[int, MacroAction]]]:
+    # Language actions with their ACTION_TABLE ids, macro plans are returned as key lists
+    lang_actions = MOVE_LANG_ACTIONS.copy()
+    action_ids = MOVE_IDS.copy()
     inv = get_inventory(obs)
-    
+
+    # Check for pathfinding actions
+    if macros:
+        macro_lang_actions, macro_env_actions = get_macro_actions(obs)
+        lang_actions += macro_lang_actions
+        action_ids += macro_env_actions
+
     # Check for attack and apply actions
     for x in get_vision(obs).split("\n"):
-        for m in range(nethack.NUMMONS):
-            if nethack.permonst(m).mname + " adjacent" in x:
-                lang_actions.append("attack the " + nethack.permonst(m).mname)
-                env_actions.append(x.split()[-1])
+        if " adjacent" not in x:
+            continue
+        direction = x.split()[-1]
+        for i, name in enumerate(MONSTER_NAMES):
+            if name + " adjacent" in x and direction in COMPASS_INDEX:
+                lang_actions.append("attack the " + name)
+                action_ids.append(get_table_id("attack", i, direction))
         if "door adjacent" in x and any("key" in x.lower() for x in inv):
             lang_actions.append("use key")
-            env_actions.append("a")
+            action_ids.append(get_table_id("use key"))
 
     # Check for pickup action
     message = get_message(obs)
     pickup_idx = message.find("You see here ")
     if pickup_idx > -1:
         lang_actions.append("pick up " + message[pickup_idx+13:].split(".")[0])
-        env_actions.append(",")
+        action_ids.append(get_table_id("pick up"))
 
     # Check for inventory acitons
     # TODO complete list of inventory actions
     for x in inv:
         if "wand" in x:
-            key = get_item_key(obs, x)
-            if key is not None:
-                for direction in compass_actions:
-                    lang_actions.append("zap " + get_item_name(obs, key) + " " + direction)
-                    env_actions.append(["z", key, direction])
+            verb = "zap"
         elif any(y in x for y in ["apple", "pear", "banana"]):
-            key = get_item_key(obs, x)
-            if key is not None:
-                lang_actions.append("eat " + get_item_name(obs, key))
-                env_actions.append(["e", key])
+            verb = "eat"
         elif any(y in x for y in ["robe", "shoes", "boots"]) and "(being worn)" not in x:
-            key = get_item_key(obs, x)
-            if key is not None:
-                lang_actions.append("wear " + get_item_name(obs, key))
-                env_actions.append(["W", key])
+            verb = "wear"
         elif "potion" in x:
-            key = get_item_key(obs, x)
-            if key is not None:
-                lang_actions.append("drink " + get_item_name(obs, key))
-                env_actions.append(["q", key])
+            verb = "drink"
         elif "ring" in x and "(on right hand)" not in x and "(on left hand)" not in x:
-            key = get_item_key(obs, x)
-            if key is not None:
-                lang_actions.append("put on " + get_item_name(obs, key))
-                env_actions.append(["P", key, "r"])
+            verb = "put on"
         elif "horn" in x:
-            key = get_item_key(obs, x)
-            if key is not None:
-                for direction in compass_actions:
-                    lang_actions.append("blow horn " + direction)
-                    env_actions.append(["a", key, "y", direction])
-
-    env_actions = [[e] if isinstance(e, str) else e for e in env_actions]
-    allowed = set(chain.from_iterable(l for e, l in NLELanguageWrapper.all_nle_action_map.items() if e in allowed))
-    lang_actions, env_actions = zip(*((l, e) for l, e in zip(lang_actions, env_actions) if e[0] in allowed))
+            verb = "blow horn"
+        else:
+            continue
+        letter, name = get_item_letter(obs, x)
+        if letter is None:
+            continue
+        if verb == "zap":
+            for direction in COMPASS_ACTIONS:
+                lang_actions.append("zap " + name + " " + direction)
+                action_ids.append(get_table_id(verb, letter, direction))
+        elif verb == "blow horn":
+            for direction in COMPASS_ACTIONS:
+                lang_actions.append("blow horn " + direction)
+                action_ids.append(get_table_id(verb, letter, direction))
+        else:
+            lang_actions.append(verb + " " + name)
+            action_ids.append(get_table_id(verb, letter))
+
+    return lang_actions, action_ids
+
+
+def get_admissible(obs, allowed=ACTIONS, macros: bool = False) -> Tuple[List[str], List[List[str]]]:
+    allowed = get_allowed_keys(allowed)
+    lang_actions, env_actions = [], []
+    for lang_action, action_id in zip(*get_admissible_ids(obs, macros=macros)):
+        env_action = action_id if isinstance(action_id, MacroAction) else ACTION_TABLE[action_id]
+        if env_action[0] in allowed:
+            lang_actions.append(lang_action)
+            env_actions.append(env_action)
     return lang_actions, env_actions
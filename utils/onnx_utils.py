@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import torch
+import onnxruntime as ort
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from transformers import AutoModelForSeq2SeqLM
+
+from utils.model_utils import get_cache_dir
+
+
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nethack-llm", "onnx")
+
+
+class EncoderWrapper(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        return self.model.encoder(input_ids=input_ids, return_dict=True).last_hidden_state
+
+
+class DecoderWrapper(torch.nn.Module):
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, decoder_input_ids: torch.Tensor, encoder_hidden: torch.Tensor) -> torch.Tensor:
+        return self.model(
+            decoder_input_ids=decoder_input_ids,
+            encoder_outputs=(encoder_hidden,),
+            return_dict=True
+        ).logits
+
+
+def move_files(src_dir: str, dst_dir: str):
+    # External data files go first so an .onnx file only appears once it is complete
+    for name in sorted(os.listdir(src_dir), key=lambda x: x.endswith(".onnx")):
+        os.replace(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+
+
+def export_onnx(checkpoint: str, onnx_dir: str, opset: int = 14):
+    model = AutoModelForSeq2SeqLM.from_pretrained(checkpoint).eval()
+    input_ids = torch.ones((1, 8), dtype=torch.long)
+    with torch.no_grad():
+        encoder_hidden = EncoderWrapper(model)(input_ids)
+        torch.onnx.export(
+            EncoderWrapper(model),
+            (input_ids,),
+            os.path.join(onnx_dir, "encoder.onnx"),
+            input_names=["input_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes=dict(
+                input_ids={0: "batch", 1: "sequence"},
+                last_hidden_state={0: "batch", 1: "sequence"}
+            ),
+            opset_version=opset
+        )
+        torch.onnx.export(
+            DecoderWrapper(model),
+            (torch.zeros((2, 4), dtype=torch.long), encoder_hidden.repeat(2, 1, 1)),
+            os.path.join(onnx_dir, "decoder.onnx"),
+            input_names=["decoder_input_ids", "encoder_hidden"],
+            output_names=["logits"],
+            dynamic_axes=dict(
+                decoder_input_ids={0: "batch", 1: "decoder_sequence"},
+                encoder_hidden={0: "batch", 1: "sequence"},
+                logits={0: "batch", 1: "decoder_sequence"}
+            ),
+            opset_version=opset
+        )
+
+
+def get_onnx_paths(checkpoint: str, quantize: bool = False, cache_dir: str = ONNX_CACHE_DIR):
+    # Exports are cached per checkpoint, quantized copies are derived from them once.
+    # Both are written to a temporary directory and moved into place, so a crashed
+    # or concurrent export never leaves truncated files behind
+    onnx_dir = get_cache_dir(checkpoint, cache_dir)
+    os.makedirs(onnx_dir, exist_ok=True)
+    paths = [os.path.join(onnx_dir, name + ".onnx") for name in ["encoder", "decoder"]]
+    if not all(os.path.exists(x) for x in paths):
+        tmp_dir = tempfile.mkdtemp(dir=onnx_dir, prefix=".export")
+        try:
+            export_onnx(checkpoint, tmp_dir)
+            move_files(tmp_dir, onnx_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    if quantize:
+        quantized = [x[:-len(".onnx")] + ".int8.onnx" for x in paths]
+        for path, quantized_path in zip(paths, quantized):
+            if not os.path.exists(quantized_path):
+                tmp_dir = tempfile.mkdtemp(dir=onnx_dir, prefix=".quantize")
+                try:
+                    quantize_dynamic(
+                        path,
+                        os.path.join(tmp_dir, os.path.basename(quantized_path)),
+                        weight_type=QuantType.QInt8,
+                        use_external_data_format=True
+                    )
+                    move_files(tmp_dir, onnx_dir)
+                finally:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+        paths = quantized
+    return paths
+
+
+class OnnxSeq2Seq:
+    def __init__(self, checkpoint: str, quantize: bool = False, num_threads: int = 0):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        encoder_path, decoder_path = get_onnx_paths(checkpoint, quantize)
+        self.encoder = ort.InferenceSession(encoder_path, options, providers=["CPUExecutionProvider"])
+        self.decoder = ort.InferenceSession(decoder_path, options, providers=["CPUExecutionProvider"])
+
+    def encode(self, input_ids: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.encoder.run(
+            ["last_hidden_state"],
+            dict(input_ids=input_ids.cpu().numpy())
+        )[0])
+
+    def decode(self, decoder_input_ids: torch.Tensor, encoder_hidden: torch.Tensor) -> torch.Tensor:
+        return torch.from_numpy(self.decoder.run(
+            ["logits"],
+            dict(
+                decoder_input_ids=decoder_input_ids.cpu().numpy(),
+                encoder_hidden=encoder_hidden.cpu().numpy()
+            )
+        )[0])
@@ -0,0 +1,192 @@
+from typing import Any, Dict, List, Optional, Tuple
+import time
+import json
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    exp_name TEXT NOT NULL,
+    actor TEXT NOT NULL,
+    shard_idx INTEGER NOT NULL,
+    num_shards INTEGER NOT NULL,
+    num_rollouts INTEGER NOT NULL,
+    created REAL NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_exp_name ON runs (exp_name);
+CREATE INDEX IF NOT EXISTS runs_actor ON runs (actor);
+
+CREATE TABLE IF NOT EXISTS episodes (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    job_id INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    rollout_id INTEGER NOT NULL,
+    steps INTEGER NOT NULL,
+    decisions INTEGER NOT NULL,
+    reward REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    wall_time REAL NOT NULL,
+    tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodes_run_task ON episodes (run_id, task);
+
+CREATE TABLE IF NOT EXISTS task_results (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    task TEXT NOT NULL,
+    num_episodes INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    deaths INTEGER NOT NULL,
+    reward_sum REAL NOT NULL,
+    steps_sum INTEGER NOT NULL,
+    wall_time_sum REAL NOT NULL,
+    tokens_sum INTEGER NOT NULL,
+    PRIMARY KEY (run_id, task)
+);
+CREATE INDEX IF NOT EXISTS task_results_task ON task_results (task);
+"""
+
+
+def get_outcome(record: Dict[str, Any]) -> str:
+    if record["success"]:
+        return "success"
+    if record["death"]:
+        return "death"
+    return "failure"
+
+
+class ResultsDB:
+    def __init__(self, path: str, batch_size: int = 1000, wal: bool = False):
+        self.conn = sqlite3.connect(path, timeout=60)
+        if wal:
+            # Lets readers query during a run, only safe when the file is on a local disk
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.pending: List[Tuple[int, Dict[str, Any]]] = []
+
+    def add_run(
+            self,
+            exp_name: str,
+            actor: str,
+            num_rollouts: int,
+            config: Dict[str, Any],
+            shard_idx: int = 0,
+            num_shards: int = 1
+        ) -> int:
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                INSERT INTO runs (exp_name, actor, shard_idx, num_shards, num_rollouts, created, config)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (exp_name, actor, shard_idx, num_shards, num_rollouts, time.time(), json.dumps(config, sort_keys=True))
+            )
+        return cursor.lastrowid
+
+    def add_episode(self, run_id: int, record: Dict[str, Any]):
+        self.pending.append((run_id, record))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        # Episodes and their per task totals are written in one transaction
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(
+                    run_id,
+                    x["job_id"],
+                    x["task"],
+                    x["rollout_id"],
+                    x["steps"],
+                    x["decisions"],
+                    x["reward"],
+                    get_outcome(x),
+                    x["wall_time"],
+                    x["tokens"],
+                ) for run_id, x in self.pending]
+            )
+            self.conn.executemany(
+                """
+                INSERT INTO task_results VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (run_id, task) DO UPDATE SET
+                    num_episodes = num_episodes + 1,
+                    successes = successes + excluded.successes,
+                    deaths = deaths + excluded.deaths,
+                    reward_sum = reward_sum + excluded.reward_sum,
+                    steps_sum = steps_sum + excluded.steps_sum,
+                    wall_time_sum = wall_time_sum + excluded.wall_time_sum,
+                    tokens_sum = tokens_sum + excluded.tokens_sum
+                """,
+                [(
+                    run_id,
+                    x["task"],
+                    int(x["success"]),
+                    int(x["death"]),
+                    x["reward"],
+                    x["steps"],
+                    x["wall_time"],
+                    x["tokens"],
+                ) for run_id, x in self.pending]
+            )
+        self.pending = []
+
+    def get_leaderboard(self, task: Optional[str] = None, limit: int = 20) -> List[sqlite3.Row]:
+        # Shards of one experiment are ranked together using the latest run of every
+        # shard, runs with fewer episodes than requested are left out as incomplete
+        query = """
+            SELECT MIN(r.run_id) AS run_id, r.exp_name, r.actor, r.num_shards, t.task,
+                SUM(t.num_episodes) AS num_episodes,
+                CAST(SUM(t.successes) AS REAL) / SUM(t.num_episodes) AS success,
+                CAST(SUM(t.deaths) AS REAL) / SUM(t.num_episodes) AS death,
+                SUM(t.reward_sum) / SUM(t.num_episodes) AS reward,
+                SUM(t.wall_time_sum) / SUM(t.num_episodes) AS wall_time,
+                CAST(SUM(t.tokens_sum) AS REAL) / SUM(t.num_episodes) AS tokens
+            FROM task_results t JOIN runs r ON r.run_id = t.run_id
+            WHERE (r.num_shards = 1 OR r.run_id = (
+                SELECT MAX(s.run_id) FROM runs s
+                WHERE s.exp_name = r.exp_name AND s.num_shards = r.num_shards AND s.shard_idx = r.shard_idx
+            )) {}
+            GROUP BY CASE WHEN r.num_shards = 1 THEN r.run_id ELSE -1 END, r.exp_name, r.num_shards, t.task
+            HAVING SUM(t.num_episodes) = MAX(r.num_rollouts)
+            ORDER BY t.task, success DESC, reward DESC
+        """.format("AND t.task = ?" if task else "")
+        self.conn.row_factory = sqlite3.Row
+        rows = self.conn.execute(query, (task,) if task else ()).fetchall()
+        self.conn.row_factory = None
+
+        # Keep the top runs of every task
+        leaderboard, counts = [], dict()
+        for row in rows:
+            counts[row["task"]] = counts.get(row["task"], 0) + 1
+            if counts[row["task"]] <= limit:
+                leaderboard.append(row)
+        return leaderboard
+
+    def get_diff(self, run_a: int, run_b: int) -> List[Tuple[str, Optional[float], Optional[float], Optional[float], Optional[float]]]:
+        return self.conn.execute(
+            """
+            SELECT t.task,
+                CAST(a.successes AS REAL) / a.num_episodes, CAST(b.successes AS REAL) / b.num_episodes,
+                a.reward_sum / a.num_episodes, b.reward_sum / b.num_episodes
+            FROM (SELECT task FROM task_results WHERE run_id IN (?, ?) GROUP BY task) t
+            LEFT JOIN task_results a ON a.task = t.task AND a.run_id = ?
+            LEFT JOIN task_results b ON b.task = t.task AND b.run_id = ?
+            ORDER BY t.task
+            """,
+            (run_a, run_b, run_a, run_b)
+        ).fetchall()
+
+    def get_config(self, run_id: int) -> Dict[str, Any]:
+        row = self.conn.execute("SELECT config FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise ValueError("Unknown run {}".format(run_id))
+        return json.loads(row[0])
+
+    def close(self):
+        self.flush()
+        self.conn.close()
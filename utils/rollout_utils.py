@@ -0,0 +1,151 @@
+from typing import Any, Callable, Dict, List, Optional
+import time
+import random
+import threading
+from queue import Queue
+import torch
+
+from actor import LLMActor
+from envs.lang_env import LangEnv
+from utils.shard_utils import get_seed
+
+
+def reset_episode(env: LangEnv, rollout_id: int, seed: Optional[int] = None) -> Dict[str, Any]:
+    start = time.perf_counter()
+    lang_obs = env.reset(seed=None if seed is None else get_seed(seed, rollout_id))
+    return dict(
+        rollout_id=rollout_id,
+        lang_obs=lang_obs,
+        actions=env.get_actions(),
+        cum_reward=0,
+        reward=0,
+        info=dict(),
+        steps=0,
+        decisions=0,
+        tokens=0,
+        trajectory=[],
+        done=False,
+        start_time=start,
+        wall_time=0.,
+        env_time=time.perf_counter() - start,
+        actor_time=0.,
+    )
+
+
+def choose_action(actor: LLMActor, episode: Dict[str, Any], seed: Optional[int] = None) -> int:
+    start = time.perf_counter()
+    if seed is not None:
+        # Seed every decision separately so episodes can be interleaved
+        decision_seed = get_seed(seed, episode["rollout_id"], episode["decisions"])
+        torch.manual_seed(decision_seed)
+        random.seed(decision_seed)
+    episode["decisions"] += 1
+
+    # Actors pick from the environment's action ids like any other list of env actions
+    lang_actions, action_ids = episode["actions"]
+    action_id, lang_action, generation, tokens = actor.get_action(
+        episode["lang_obs"],
+        lang_actions,
+        action_ids,
+        return_tuple=True
+    )
+    episode["tokens"] += tokens
+    episode["trajectory"].append(dict(
+        state=episode["lang_obs"],
+        admissible=lang_actions,
+        action=lang_action,
+        generation=generation,
+    ))
+    episode["actor_time"] += time.perf_counter() - start
+    return action_id
+
+
+def step_episode(
+        env: LangEnv,
+        episode: Dict[str, Any],
+        action_id: int,
+        max_episode_steps: Optional[int] = None
+    ):
+    start = time.perf_counter()
+    # Capped per key so long macro plans can not run past the step limit
+    max_steps = None if max_episode_steps is None else max_episode_steps - episode["steps"]
+    episode["lang_obs"], episode["reward"], episode["done"], episode["info"], steps = env.step_id(action_id, max_steps)
+    episode["cum_reward"] += episode["reward"]
+    episode["steps"] += steps
+
+    if max_episode_steps is not None and episode["steps"] >= max_episode_steps:
+        episode["done"] = True
+    if not episode["done"]:
+        episode["actions"] = env.get_actions()
+    episode["env_time"] += time.perf_counter() - start
+    if episode["done"]:
+        # Includes time spent waiting in the pipeline queues
+        episode["wall_time"] = time.perf_counter() - episode["start_time"]
+
+
+def run_sequential(
+        env: LangEnv,
+        actor: LLMActor,
+        rollout_ids: List[int],
+        on_episode: Callable[[Dict[str, Any]], None],
+        seed: Optional[int] = None,
+        max_episode_steps: Optional[int] = None
+    ):
+    for rollout_id in rollout_ids:
+        episode = reset_episode(env, rollout_id, seed)
+        actor.reset(env.get_task())
+        while not episode["done"]:
+            step_episode(env, episode, choose_action(actor, episode, seed), max_episode_steps)
+        on_episode(episode)
+
+
+def run_pipelined(
+        envs: List[LangEnv],
+        actor: LLMActor,
+        rollout_ids: List[int],
+        on_episode: Callable[[Dict[str, Any]], None],
+        seed: Optional[int] = None,
+        max_episode_steps: Optional[int] = None
+    ):
+    # Environments are stepped on a worker thread while the actor runs on this one,
+    # each environment holds one live episode which moves between the two queues
+    envs = envs[:len(rollout_ids)]
+    obs_queue = Queue(maxsize=2 * len(envs))
+    action_queue = Queue(maxsize=len(envs))
+    pending = iter(rollout_ids)
+
+    def env_worker():
+        try:
+            for env in envs:
+                obs_queue.put((env, reset_episode(env, next(pending), seed)))
+            while True:
+                item = action_queue.get()
+                if item is None:
+                    return
+                env, episode, action_id = item
+                step_episode(env, episode, action_id, max_episode_steps)
+                obs_queue.put((env, episode))
+                if episode["done"]:
+                    rollout_id = next(pending, None)
+                    if rollout_id is not None:
+                        obs_queue.put((env, reset_episode(env, rollout_id, seed)))
+        except Exception as e:
+            obs_queue.put((None, e))
+
+    actor.reset(envs[0].get_task())
+    worker = threading.Thread(target=env_worker, daemon=True)
+    worker.start()
+    finished = 0
+    try:
+        while finished < len(rollout_ids):
+            env, episode = obs_queue.get()
+            if isinstance(episode, Exception):
+                raise episode
+            if episode["done"]:
+                on_episode(episode)
+                finished += 1
+            else:
+                action_queue.put((env, episode, choose_action(actor, episode, seed)))
+    finally:
+        action_queue.put(None)
+        worker.join()
@@ -0,0 +1,154 @@
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+import glob
+import json
+import math
+import struct
+import hashlib
+
+
+# Settings that change episode results, node local settings like --pipeline or --db are left out
+RESULT_KEYS = [
+    "actor",
+    "max_episode_steps",
+    "macros",
+    "fewshot",
+    "retrieve",
+    "fewshot_file",
+    "action_temp",
+    "cot",
+    "letter",
+    "dtype",
+    "backend",
+    "quantize",
+]
+
+
+def get_seed(*keys: int) -> int:
+    # sha256 of the packed ints, unlike hash() it is the same on every interpreter
+    digest = hashlib.sha256(struct.pack("<{}q".format(len(keys)), *keys)).digest()
+    return int.from_bytes(digest[:4], "little")
+
+
+def get_result_config(args: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: args[k] for k in RESULT_KEYS}
+
+
+def get_jobs(tasks: List[str], num_rollouts: int, seed: Optional[int], config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Jobs carry the seed their environment is reset with
+    return [
+        dict(
+            job_id=i,
+            task=task,
+            rollout_id=rollout_id,
+            seed=None if seed is None else get_seed(seed, rollout_id),
+            config=config
+        )
+        for i, (task, rollout_id) in enumerate((t, r) for t in tasks for r in range(num_rollouts))
+    ]
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    match = re.fullmatch(r"(\d+)/(\d+)", shard)
+    if match is None or not int(match.group(1)) < int(match.group(2)):
+        raise ValueError("Shard should be i/N with 0 <= i < N, got {}".format(shard))
+    return int(match.group(1)), int(match.group(2))
+
+
+def get_shard(jobs: List[Dict[str, Any]], shard_idx: int, num_shards: int) -> List[Dict[str, Any]]:
+    # Round robin so every shard gets a similar mix of tasks
+    return jobs[shard_idx::num_shards]
+
+
+def get_shard_path(exp_name: str, shard_idx: int, num_shards: int) -> str:
+    return "{}.shard-{}-of-{}.json".format(exp_name, shard_idx, num_shards)
+
+
+def write_json(path: str, obj: Any):
+    tmp_path = path + ".tmp{}".format(os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def write_manifest(path: str, jobs: List[Dict[str, Any]], num_shards: int):
+    # Every node expands the same manifest, a mismatch means the nodes were launched differently
+    manifest = dict(num_shards=num_shards, jobs=jobs)
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f) != manifest:
+                raise ValueError("Jobs or shard count do not match the existing manifest {}, delete it to start over".format(path))
+    else:
+        write_json(path, manifest)
+
+
+def get_episode_record(job_id: int, task: str, episode: Dict[str, Any]) -> Dict[str, Any]:
+    success = float(episode["reward"]) > 0
+    return dict(
+        job_id=job_id,
+        task=task,
+        rollout_id=episode["rollout_id"],
+        reward=float(episode["cum_reward"]),
+        success=success,
+        death=not success and int(episode["info"].get("end_status", 0)) == 1,
+        steps=episode["steps"],
+        decisions=episode["decisions"],
+        tokens=episode["tokens"],
+        wall_time=episode["wall_time"],
+        env_time=episode["env_time"],
+        actor_time=episode["actor_time"],
+    )
+
+
+def get_interval(successes: int, n: int, z: float = 1.96) -> Tuple[float, float]:
+    # Wilson score interval
+    if n == 0:
+        return 0., 1.
+    p = successes / n
+    center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    margin = z * math.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+    return center - margin, center + margin
+
+
+def summarize_episodes(records: List[Dict[str, Any]], tasks: List[str]) -> Dict[str, Dict[str, Any]]:
+    results = dict()
+    for task in tasks:
+        task_records = [x for x in records if x["task"] == task]
+        n = len(task_records)
+        reward_sum = sum(x["reward"] for x in task_records)
+        reward_sq_sum = sum(x["reward"] ** 2 for x in task_records)
+        successes = sum(x["success"] for x in task_records)
+        deaths = sum(x["death"] for x in task_records)
+        results[task] = dict(
+            reward=reward_sum / n if n else 0,
+            success=successes / n if n else 0,
+            death=deaths / n if n else 0,
+            num_episodes=n,
+            successes=successes,
+            deaths=deaths,
+            reward_sum=reward_sum,
+            reward_sq_sum=reward_sq_sum,
+            success_interval=get_interval(successes, n),
+        )
+    return results
+
+
+def merge_shards(exp_name: str) -> Dict[str, Dict[str, Any]]:
+    with open(exp_name + ".manifest.json") as f:
+        manifest = json.load(f)
+    jobs = manifest["jobs"]
+
+    # Only shards of the manifest's split, files left from a split with another N are ignored
+    records = dict()
+    for path in sorted(glob.glob(glob.escape(exp_name) + ".shard-*-of-{}.json".format(manifest["num_shards"]))):
+        with open(path) as f:
+            for record in json.load(f)["episodes"]:
+                if record["job_id"] in records:
+                    raise ValueError("Job {} appears in more than one shard".format(record["job_id"]))
+                records[record["job_id"]] = record
+
+    missing = [x["job_id"] for x in jobs if x["job_id"] not in records]
+    if missing:
+        raise ValueError("{} jobs have no results yet, first missing job is {}".format(len(missing), missing[0]))
+    return summarize_episodes(list(records.values()), list(dict.fromkeys(x["task"] for x in jobs)))